@@ -3,7 +3,9 @@ from flint_pxd_autogen import write_flint_cython_headers
 
 # where the output files will be created
 OUTPUT_DIR = 'pxd_headers'
-if not os.path.isdir(OUTPUT_DIR):
-    os.mkdir(OUTPUT_DIR)
 
-write_flint_cython_headers(OUTPUT_DIR)
+if __name__ == '__main__':
+    if not os.path.isdir(OUTPUT_DIR):
+        os.mkdir(OUTPUT_DIR)
+
+    write_flint_cython_headers(OUTPUT_DIR)
@@ -1,2 +1,3 @@
-from .env import FLINT_INCLUDE_DIR, FLINT_DOC_DIR
-from .autogen import extract_functions, write_flint_cython_headers
+from .env import FLINT_INCLUDE_DIR, FLINT_DOC_DIR, CACHE_DIR, validate_env
+from .extractor import Extractor, extract_functions
+from .autogen import process_rst, write_flint_cython_headers
@@ -16,314 +16,193 @@ headers.
 #                  http://www.gnu.org/licenses/
 #*****************************************************************************
 
-import os, shutil
-from .env import FLINT_INCLUDE_DIR, FLINT_DOC_DIR
+import filecmp, os, shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from string import Template
+from .env import FLINT_INCLUDE_DIR, FLINT_DOC_DIR, CACHE_DIR, validate_env
+from .extractor import extract_functions, _PARSER_MTIME
+
+
+# Beginning of the generated .pxd files
+_PXD_PRELUDE = (
+    '# distutils: libraries = flint\n'
+    '# distutils: depends = flint/{prefix}.h\n'
+    '\n' +
+    '#' * 80 + '\n'
+    '# This file is auto-generated. Do not modify by hand\n' +
+    '#' * 80 + '\n'
+    '\n'
+    'from libc.stdio cimport FILE\n'
+    'from sage.libs.gmp.types cimport *\n'
+    'from sage.libs.mpfr.types cimport *\n'
+    'from sage.libs.flint.types cimport *\n'
+    '\n'
+    'cdef extern from "flint_wrap.h":\n')
+
+# .pxd files older than the generator are regenerated
+_GENERATOR_MTIME = max(os.stat(__file__).st_mtime_ns, _PARSER_MTIME)
+
+
+def _list_files(directory):
+    r"""
+    Return the set of names of the files in ``directory``.
+    """
+    with os.scandir(directory) as it:
+        return {entry.name for entry in it if entry.is_file()}
 
 
-class Extractor:
+def _write_if_changed(filename, text):
     r"""
-    Tool to extract function declarations from a flint .rst file
-    """
-    NONE = 0
-    DOC = 1
-    FUNCTION_DECLARATION = 2
-    MACRO_DECLARATION = 4
-    TYPE_DECLARATION = 8
-
-    def __init__(self, filename):
-        self.filename = filename
-        if not filename.endswith('.rst'):
-            raise ValueError
-
-        # Attributes that are modified throughout the document parsing
-        self.state = self.NONE    # position in the documentation
-        self.section = None       # current section
-        self.content = {}         # section -> list of pairs (function signatures, func documentation)
-        self.functions = []       # current list of pairs (function signatures, func documentation)
-        self.signatures = []      # current list of function/macro/type signatures
-        self.doc = []             # current function documentation
+    Write ``text`` in ``filename`` unless the file already has this content.
 
+    Unchanged files keep their modification time so that the sage modules
+    depending on them do not get recompiled.
+    """
+    try:
         with open(filename) as f:
-            text = f.read()
-        self.lines = text.splitlines()
-        self.i = 0
-
-    def run(self):
-        while self.process_line():
-            pass
-        if self.state & self.FUNCTION_DECLARATION:
-            self.add_function()
-        if self.state & self.MACRO_DECLARATION:
-            self.add_macro()
-        if self.functions:
-            self.update_section()
-        self.state = self.NONE
-
-    def update_section(self):
-        if self.section not in self.content:
-            self.content[self.section] = []
-        self.content[self.section] += tuple(self.functions)
-        self.functions.clear()
-
-    def clean_doc(self):
-        # Remove empty lines at the end of documentation
-        while self.doc and not self.doc[-1]:
-            self.doc.pop()
-
-        for i, line in enumerate(self.doc):
-            # To make sage linter happier
-            line = line.replace('\\choose ', 'choose ')
-            self.doc[i] = line
-
-    @staticmethod
-    def has_boolean_return_type(func_signature):
-        r"""
-        Determine whether the function func_signature has a boolean return type.
-
-        If so, it will be declared in Cython as `bint` rather than `int`.
-        """
-        if func_signature.count('(') != 1 or func_signature.count(')') != 1:
-            return False
-
-        j = func_signature.index('(')
-        func_name = func_signature[:j].strip().split()
-        if len(func_name) != 2:
-            return False
-
-        return_type = func_name[0]
-        if return_type != 'int':
-            return False
-
-        func_name = func_name[1]
-
-        return func_name.startswith('is_') or \
-               '_is_' in func_name or \
-               func_name.endswith('_eq') or \
-               func_name.endswith('_ne') or \
-               func_name.endswith('_lt') or \
-               func_name.endswith('_le') or \
-               func_name.endswith('_gt') or \
-               func_name.endswith('_ge') or \
-               '_contains_' in func_name or \
-               func_name.endswith('_contains') or \
-               '_equal_' in func_name or \
-               func_name.endswith('_equal') or \
-               func_name.endswith('_overlaps')
-
-    def clean_signatures(self):
-        if (self.state & self.FUNCTION_DECLARATION) or (self.state & self.MACRO_DECLARATION):
-            for i, func_signature in enumerate(self.signatures):
-                replacement = [('(void)', '()'), (' enum ', ' ')]
-                for bad_type, good_type in replacement:
-                    func_signature = func_signature.replace(bad_type, good_type)
-
-                bad_arg_names = [('in', 'input'), ('lambda', 'lmbda'), ('iter', 'it')]
-                replacements = [(pattern.format(bad), pattern.format(good)) for pattern in [' {},', ' {})', '*{},', '*{})'] for bad, good in bad_arg_names]
-                for bad_form, good_form in replacements:
-                    func_signature = func_signature.replace(bad_form, good_form)
-
-                if self.has_boolean_return_type(func_signature):
-                    func_signature = func_signature.strip()
-                    if not func_signature.startswith('int '):
-                        raise RuntimeError
-                    func_signature = 'b' + func_signature
-
-                self.signatures[i] = func_signature
-
-    def add_declaration(self):
-        if self.state & self.FUNCTION_DECLARATION:
-            self.add_function()
-        elif self.state & self.MACRO_DECLARATION:
-            self.add_macro()
-        elif self.state & self.TYPE_DECLARATION:
-            self.add_type()
-
-        self.signatures.clear()
-        self.doc.clear()
-        self.state = self.NONE
-
-    def add_function(self):
-        self.clean_doc()
-
-        # Drop va_list argument
-        signatures = []
-        for func_signature in self.signatures:
-            if '(' not in func_signature or ')' not in func_signature:
-                raise RuntimeError(func_signature)
-            elif 'va_list ' in func_signature:
-                print('Warning: va_list unsupported {}'.format(func_signature))
-            else:
-                signatures.append(func_signature)
-        self.signatures = signatures
-        self.clean_signatures()
-
-        self.functions.append((tuple(self.signatures), tuple(self.doc)))
-
-    def add_macro(self):
-        # TODO: we might want to support auto-generation of macros
-        return
-
-    def add_type(self):
-        # TODO: we might want to support auto-generation of types
-        return
-
-    def process_line(self):
-        r"""
-        Process one line of documentation.
-        """
-        if self.i >= len(self.lines):
-            return 0
-
-        if bool(self.state & self.FUNCTION_DECLARATION) + bool(self.state & self.MACRO_DECLARATION) + bool(self.state & self.TYPE_DECLARATION) > 1:
-            raise RuntimeError('self.state = {} and i = {}'.format(self.state, self.i))
-
-        line = self.lines[self.i]
-        if line.startswith('.. function::'):
-            self.add_declaration()
-            if line[13] != ' ':
-                print('Warning: no space {}'.format(line))
-            self.signatures.append(line[13:].strip())
-            self.state = self.FUNCTION_DECLARATION
-            self.i += 1
-        elif line.startswith('.. macro::'):
-            self.add_declaration()
-            if line[10] != ' ':
-                print('Warning no space{}'.format(line))
-            self.signatures.append(line[10:].strip())
-            self.state = self.MACRO_DECLARATION
-            self.i += 1
-        elif line.startswith('.. type::'):
-            # type
-            # NOTE: we do nothing as the documentation duplicates type declaration
-            # and lacks the actual list of attributes
-            self.add_declaration()
-            self.state = self.TYPE_DECLARATION
-            self.i += 1
-        elif self.state == self.FUNCTION_DECLARATION:
-            if len(line) > 14 and line.startswith(' ' * 14):
-                # function with similar declaration
-                line = line[14:].strip()
-                if line:
-                    self.signatures.append(line)
-                self.i += 1
-            elif not line.strip():
-                # leaving function declaration
-                self.state |= self.DOC
-                self.i += 1
-            else:
-                raise ValueError(line)
-        elif self.state == self.MACRO_DECLARATION:
-            if len(line) > 10 and line.startswith(' ' * 10):
-                # macro with similar declaration
-                line = line[10:].strip()
-                if line:
-                    self.signatures.append(line)
-                self.i += 1
-            elif not line.strip():
-                # leaving macro declaration
-                self.state |= self.DOC
-                self.i += 1
-            else:
-                raise ValueError(line)
-        elif (self.state & self.DOC) and line.startswith('    '):
-            # function doc
-            line = line.strip()
-            if line:
-                self.doc.append(line)
-            self.i += 1
-        elif self.i + 1 < len(self.lines) and self.lines[self.i + 1].startswith('----'):
-            # new section
-            self.add_declaration()
-            if self.functions:
-                self.update_section()
-            section = line
-            self.i += 2
-        elif not line:
-            self.i += 1
-        else:
-            self.add_declaration()
-            self.i += 1
+            if f.read() == text:
+                return
+    except FileNotFoundError:
+        pass
 
-        return 1
+    with open(filename, 'w') as output:
+        output.write(text)
 
 
-def extract_functions(filename):
+def _is_up_to_date(filename, output_dir, flint_headers, macro_files):
     r"""
-    OUTPUT:
+    Return whether the .pxd file corresponding to ``filename`` exists and is
+    more recent than ``filename``, than its macros file if any and than the
+    generator.
+    """
+    prefix = filename[:-4]
+    if prefix + '.h' not in flint_headers:
+        return False
+    try:
+        mtime = os.stat(os.path.join(output_dir, prefix + '.pxd')).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    if mtime <= _GENERATOR_MTIME or mtime <= os.stat(os.path.join(FLINT_DOC_DIR, filename)).st_mtime_ns:
+        return False
+    return prefix + '_macros.pxd' not in macro_files or \
+           mtime > os.stat(os.path.join('macros', prefix + '_macros.pxd')).st_mtime_ns
+
+
+def _missing_dependency(prefix, flint_headers):
+    r"""
+    Return whether the .pxd file for the flint header ``prefix`` must be
+    skipped because another flint header it depends on is missing.
+    """
+    if prefix == "machine_vectors":
+        # TODO: fix me
+        if 'fft_small.h' not in flint_headers:
+            print('Warning: skipping machine_vectors.h because fft_small.h is not there')
+            return True
+    return False
+
 
-    dictionary: section -> list of pairs (func_sig, doc)
+def process_rst(filename, output_dir, flint_headers=None, content=None, macro_files=None):
+    r"""
+    Write the .pxd header corresponding to the flint documentation file
+    ``filename``.
+
+    Return the name of the associated flint header or ``None`` if no .pxd file
+    was written. If the .pxd file is more recent than ``filename``, than its
+    macros file and than the generator it is kept as is.
+
+    Arguments
+    filename -- (string) name of the .rst file in ``FLINT_DOC_DIR``
+    output_dir -- (string) path where to write the .pxd file
+    flint_headers -- (optional set) names of the files in ``FLINT_INCLUDE_DIR``
+    content -- (optional dictionary) content of ``filename`` as returned by
+               ``extract_functions``, in which case the .pxd file is
+               regenerated
+    macro_files -- (optional set) names of the files in the ``macros`` directory
     """
-    e = Extractor(filename)
-    e.run()
-    return e.content
+    if flint_headers is None:
+        flint_headers = _list_files(FLINT_INCLUDE_DIR)
+    if macro_files is None:
+        macro_files = _list_files('macros')
+    prefix = filename[:-4]
+    header = prefix + '.h'
+
+    if _missing_dependency(prefix, flint_headers):
+        return None
+
+    # NOTE: a given content comes from a file already known to be outdated
+    if content is None:
+        if _is_up_to_date(filename, output_dir, flint_headers, macro_files):
+            # NOTE: the .pxd file is up to date
+            return header
+        content = extract_functions(os.path.join(FLINT_DOC_DIR, filename), CACHE_DIR)
+    if not content:
+        # NOTE: skip files with no function declaration
+        return None
+
+    # try to match header
+    if header not in flint_headers:
+        print('Warning: skipping {} because no associated .h found'.format(filename))
+        return None
+
+    parts = [_PXD_PRELUDE.format(prefix=prefix)]
+
+    parts.extend(
+        ('    ## {}\n'.format(section) if section is not None else '') +
+        ''.join('\n' +
+                ''.join('    {}\n'.format(line) for line in func_signatures) +
+                ''.join('    # {}\n'.format(line) for line in doc)
+                for func_signatures, doc in functions)
+        for section, functions in content.items())
+
+    if prefix + '_macros.pxd' in macro_files:
+        parts.append('\nfrom .{} cimport *\n'.format(prefix + '_macros'))
+
+    # NOTE: the .pxd file is written with a single call
+    with open(os.path.join(output_dir, prefix + '.pxd'), 'w') as output:
+        output.write(''.join(parts))
+
+    return header
 
 
 def write_flint_cython_headers(output_dir):
     r"""
     Write cython header files.
 
+    The .rst files are parsed in parallel and their parsed content is cached
+    in ``CACHE_DIR`` across runs. The .pxd files that are more recent than
+    their .rst file, their macros file and the generator are not regenerated.
+    Remove them to force their regeneration.
+
     Arguments
     output_dir -- (string) path where to write the .pxd files
     """
+    validate_env()
+
+    # NOTE: the files are sorted so that the list of headers in flint_wrap.h
+    # and types.pxd does not depend on the order of the directory listing
+    with os.scandir(FLINT_DOC_DIR) as it:
+        filenames = sorted(entry.name for entry in it if entry.is_file() and entry.name.endswith('.rst'))
+    flint_headers = _list_files(FLINT_INCLUDE_DIR)
+    macro_files = _list_files('macros')
+
+    # parse the outdated files in parallel and write the .pxd files serially
+    outdated = [filename for filename in filenames if not _is_up_to_date(filename, output_dir, flint_headers, macro_files)]
+    with ProcessPoolExecutor() as executor:
+        contents = dict(zip(outdated, executor.map(extract_functions,
+                                                   [os.path.join(FLINT_DOC_DIR, filename) for filename in outdated],
+                                                   repeat(CACHE_DIR))))
     header_list = []
-    for filename in os.listdir(FLINT_DOC_DIR):
-        if not filename.endswith('.rst'):
-            continue
-        prefix = filename[:-4]
-
-        absolute_filename = os.path.join(FLINT_DOC_DIR, filename)
-        content = extract_functions(absolute_filename)
-        if not content:
-            # NOTE: skip files with no function declaration
-            continue
-
-        # try to match header
-        header = prefix + '.h'
-        absolute_header = os.path.join(FLINT_INCLUDE_DIR, header)
-        if not os.path.isfile(absolute_header):
-            print('Warning: skipping {} because no associated .h found'.format(filename))
-            continue
-        if prefix == "machine_vectors":
-            # TODO: fix me
-            fft_small_absolute_header = os.path.join(FLINT_INCLUDE_DIR, 'fft_small.h')
-            if not os.path.isfile(fft_small_absolute_header):
-                print('Warning: skipping machine_vectors.h because fft_small.h is not there')
-                continue
-        header_list.append(header)
-
-        output = open(os.path.join(output_dir, prefix + '.pxd'), 'w')
-
-        print('# distutils: libraries = flint', file=output)
-        print('# distutils: depends = flint/{}'.format(prefix + '.h'), file=output)
-        print(file=output)
-        print('#' * 80, file=output)
-        print('# This file is auto-generated. Do not modify by hand', file=output)
-        print('#' * 80, file=output)
-        print(file=output)
-
-        print('from libc.stdio cimport FILE', file=output)
-        print('from sage.libs.gmp.types cimport *', file=output)
-        print('from sage.libs.mpfr.types cimport *', file=output)
-        print('from sage.libs.flint.types cimport *', file=output)
-        print(file=output)
-
-        print('cdef extern from "flint_wrap.h":', file=output)
-
-        for section in content:
-            if section is not None:
-                print('    ## {}'.format(section), file=output)
-            for func_signatures, doc in content[section]:
-                print(file=output)
-                for line in func_signatures:
-                    print('    {}'.format(line), file=output)
-                for line in doc:
-                    print('    # {}'.format(line), file=output)
-
-        if os.path.isfile(os.path.join('macros', prefix + '_macros.pxd')):
-            print('\nfrom .{} cimport *'.format(prefix + '_macros'), file=output)
-
-        output.close()
-
+    for filename in filenames:
+        if filename in contents:
+            header = process_rst(filename, output_dir, flint_headers, contents[filename], macro_files)
+        elif _missing_dependency(filename[:-4], flint_headers):
+            header = None
+        else:
+            # NOTE: the .pxd file is up to date
+            header = filename[:-4] + '.h'
+        if header is not None:
+            header_list.append(header)
 
     for extra_header in ['nmod_types.h']:
         if extra_header in header_list:
@@ -331,15 +210,18 @@ def write_flint_cython_headers(output_dir):
         header_list.append(extra_header)
 
     with open('flint_wrap.h.template') as f:
-        text = f.read()
-    with open(os.path.join(output_dir, 'flint_wrap.h'), 'w') as output:
-        output.write(text.format(HEADER_LIST='\n'.join('#include <flint/{}>'.format(header) for header in header_list)))
+        template = Template(f.read())
+    _write_if_changed(os.path.join(output_dir, 'flint_wrap.h'),
+                      template.substitute(HEADER_LIST='\n'.join('#include <flint/{}>'.format(header) for header in header_list)))
 
     with open('types.pxd.template') as f:
-        text = f.read()
-    with open(os.path.join(output_dir, 'types.pxd'), 'w') as output:
-        output.write(text.format(HEADER_LIST=' '.join('flint/{}'.format(header) for header in header_list)))
-
-    for filename in os.listdir('macros'):
-        prefix = filename[:-4]
-        shutil.copy(os.path.join('macros', filename), os.path.join(output_dir, filename))
+        template = Template(f.read())
+    _write_if_changed(os.path.join(output_dir, 'types.pxd'),
+                      template.substitute(HEADER_LIST=' '.join('flint/{}'.format(header) for header in header_list)))
+
+    output_files = _list_files(output_dir)
+    for filename in macro_files:
+        source = os.path.join('macros', filename)
+        target = os.path.join(output_dir, filename)
+        if filename not in output_files or not filecmp.cmp(source, target, shallow=False):
+            shutil.copy(source, target)
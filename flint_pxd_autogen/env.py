@@ -13,15 +13,25 @@ Paths of the flint source and installation
 
 import os
 
-if not os.path.isdir('flint2'):
-    raise ValueError('You must first clone the flint git repo')
-
 # location of flint headers
 FLINT_INCLUDE_DIR = "/home/doctorant/sage/local/include/flint"
-if not os.path.isdir(FLINT_INCLUDE_DIR):
-    raise ValueError('Flint headers not found ({})'.format(FLINT_INCLUDE_DIR))
 
 # location of flint documentation source files
 FLINT_DOC_DIR = 'flint2/doc/source'
-if not os.path.isdir(FLINT_DOC_DIR):
-    raise ValueError('Flint doc not found ({})'.format(FLINT_DOC_DIR))
+
+# location of the cache of the parsed flint documentation
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'flint_pxd_autogen')
+
+
+def validate_env():
+    r"""
+    Check that the flint git repo, headers and documentation are available.
+    """
+    if not os.path.isdir('flint2'):
+        raise ValueError('You must first clone the flint git repo')
+
+    if not os.path.isdir(FLINT_INCLUDE_DIR):
+        raise ValueError('Flint headers not found ({})'.format(FLINT_INCLUDE_DIR))
+
+    if not os.path.isdir(FLINT_DOC_DIR):
+        raise ValueError('Flint doc not found ({})'.format(FLINT_DOC_DIR))
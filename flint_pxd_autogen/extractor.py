@@ -0,0 +1,392 @@
+r"""
+Extraction of the function declarations from the flint .rst documentation
+"""
+
+#*****************************************************************************
+#       Copyright (C) 2023 Vincent Delecroix <20100.delecroix@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#                  http://www.gnu.org/licenses/
+#*****************************************************************************
+
+import hashlib, mmap, os, re, pickle, tempfile
+from functools import lru_cache
+
+
+# Line separators of str.splitlines (together with the lone carriage returns
+# translated by text-mode reads) and content of a line in UTF-8 encoded bytes
+_EOL = rb'(?:\r\n|[\n\r\x0b\x0c\x1c-\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9])'
+_TEXT = rb'[^\n\r\x0b\x0c\x1c-\x1e\xc2\xe2]*(?:(?:\xc2(?!\x85)|\xe2(?!\x80[\xa8\xa9]))[^\n\r\x0b\x0c\x1c-\x1e\xc2\xe2]*)*'
+
+# A line of a flint .rst file is either a function/macro/type directive, a
+# section title (ie followed by a line of dashes) or any other line. The
+# pattern works on the raw bytes of the file and splits lines the same way
+# as str.splitlines. Section titles starting with a non-ASCII character are
+# matched as two plain lines, which the parser handles the same way.
+_LINE_RE = re.compile(rb"""
+    (?:
+        \.\.[ ](?P<directive>function|macro|type)::(?P<declaration>%(text)s)
+      | (?P<section>[!-~]%(text)s)%(eol)s----%(text)s
+      | (?P<line>%(text)s)
+    )(?:%(eol)s|\Z)""" % {b'text': _TEXT, b'eol': _EOL}, re.VERBOSE)
+
+# Replacements in function signatures: empty argument list, enum keyword and
+# argument names that are Python keywords or builtins
+_SIGNATURE_REPLACEMENTS = {
+    '(void)': '()',
+    ' enum ': ' ',
+    'in': 'input',
+    'lambda': 'lmbda',
+    'iter': 'it',
+}
+# argument names are only replaced after a space or a star and before a comma
+# or a closing parenthesis
+_SIGNATURE_RE = re.compile(r'\(void\)| enum |(?<=[ *])(?:in|lambda|iter)(?=[,)])')
+
+
+def _signature_replacement(m):
+    return _SIGNATURE_REPLACEMENTS[m.group()]
+
+
+# names of the functions returning a boolean (when their return type is int)
+_BOOLEAN_NAME_RE = re.compile(r'^is_|_is_|_contains_|_equal_|_(?:eq|ne|lt|le|gt|ge|contains|equal|overlaps)$')
+
+
+class Extractor:
+    r"""
+    Tool to extract function declarations from a flint .rst file
+    """
+    NONE = 0
+    DOC = 1
+    FUNCTION_DECLARATION = 2
+    MACRO_DECLARATION = 4
+    TYPE_DECLARATION = 8
+
+    # combinations of states
+    DECLARATION = FUNCTION_DECLARATION | MACRO_DECLARATION | TYPE_DECLARATION
+    SIGNATURE_DECLARATION = FUNCTION_DECLARATION | MACRO_DECLARATION
+
+    # state entered by each directive
+    DIRECTIVE_STATES = {
+        b'function': FUNCTION_DECLARATION,
+        b'macro': MACRO_DECLARATION,
+        b'type': TYPE_DECLARATION,
+    }
+
+    # indentation of continuation lines of declarations and of documentation
+    FUNCTION_INDENT = 14
+    MACRO_INDENT = 10
+    DOC_INDENT = 4
+
+    __slots__ = ('filename', 'data', 'state', 'section', 'content', 'functions', 'signatures', 'doc')
+
+    def __init__(self, filename):
+        self.reset(filename)
+
+    def reset(self, filename):
+        r"""
+        Prepare the extractor for parsing ``filename``.
+
+        This allows to parse several files with the same instance.
+        """
+        self.filename = filename
+        if not filename.endswith('.rst'):
+            raise ValueError
+
+        # Attributes that are modified throughout the document parsing
+        # NOTE: the containers are rebound rather than cleared as the ones
+        # from a previous parsing may still be referenced
+        self.state = self.NONE    # position in the documentation
+        self.section = None       # current section
+        self.content = {}         # section -> list of pairs (function signatures, func documentation)
+        self.functions = []       # current list of pairs (function signatures, func documentation)
+        self.signatures = []      # current list of function/macro/type signatures
+        self.doc = []             # current function documentation
+
+        # NOTE: the file is mapped in memory and only the lines that are
+        # stored in self.content get decoded
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            self.data = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can not be mapped
+            self.data = b''
+        finally:
+            os.close(fd)
+
+    def run(self):
+        r"""
+        Parse the documentation in a single pass over the regular expression
+        matches of its lines.
+        """
+        # NOTE: constants and the current state are bound to local variables
+        # as this loop runs over every line of the documentation. The state is
+        # reread at each line since the add_* methods modify it.
+        FUNCTION_DECLARATION = self.FUNCTION_DECLARATION
+        MACRO_DECLARATION = self.MACRO_DECLARATION
+        DECLARATION = self.DECLARATION
+        DOC = self.DOC
+        FUNCTION_INDENT = self.FUNCTION_INDENT
+        MACRO_INDENT = self.MACRO_INDENT
+        DOC_INDENT = self.DOC_INDENT
+
+        try:
+            for m in _LINE_RE.finditer(self.data):
+                state = self.state
+
+                # NOTE: sanity check of the state, skipped with python -O
+                if __debug__:
+                    # at most one declaration flag is set
+                    declaration = state & DECLARATION
+                    if declaration & (declaration - 1):
+                        raise RuntimeError('self.state = {} and line = {!r}'.format(state, m.group()))
+
+                directive = m.group('directive')
+                if directive is not None:
+                    self.add_declaration()
+                    # NOTE: for types we do nothing as the documentation duplicates
+                    # type declaration and lacks the actual list of attributes
+                    if directive != b'type':
+                        declaration = m.group('declaration').decode('utf-8')
+                        if declaration[:1] != ' ':
+                            print('Warning: no space {}'.format(m.group().decode('utf-8')))
+                        self.signatures.append(declaration.strip())
+                    self.state = self.DIRECTIVE_STATES[directive]
+                    continue
+
+                section = m.group('section')
+                line = m.group('line') if section is None else section
+                stripped = line.lstrip(b' ')
+                indent = len(line) - len(stripped)
+                if state == FUNCTION_DECLARATION:
+                    if indent >= FUNCTION_INDENT and len(line) > FUNCTION_INDENT:
+                        # function with similar declaration
+                        line = stripped.decode('utf-8').strip()
+                        if line:
+                            self.signatures.append(line)
+                    elif not stripped.decode('utf-8').strip():
+                        # leaving function declaration
+                        self.state = state | DOC
+                    else:
+                        raise ValueError(line.decode('utf-8'))
+                elif state == MACRO_DECLARATION:
+                    if indent >= MACRO_INDENT and len(line) > MACRO_INDENT:
+                        # macro with similar declaration
+                        line = stripped.decode('utf-8').strip()
+                        if line:
+                            self.signatures.append(line)
+                    elif not stripped.decode('utf-8').strip():
+                        # leaving macro declaration
+                        self.state = state | DOC
+                    else:
+                        raise ValueError(line.decode('utf-8'))
+                elif (state & DOC) and indent >= DOC_INDENT:
+                    # function doc
+                    line = stripped.decode('utf-8').strip()
+                    if line:
+                        self.doc.append(line)
+                elif section is not None:
+                    # new section
+                    self.add_declaration()
+                    if self.functions:
+                        self.update_section()
+                elif line:
+                    self.add_declaration()
+        finally:
+            # NOTE: the mapping is also released when parsing fails
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+
+        if self.state & self.FUNCTION_DECLARATION:
+            self.add_function()
+        if self.state & self.MACRO_DECLARATION:
+            self.add_macro()
+        if self.functions:
+            self.update_section()
+        self.state = self.NONE
+
+    def update_section(self):
+        self.content.setdefault(self.section, []).extend(self.functions)
+        self.functions.clear()
+
+    def clean_doc(self):
+        # Remove empty lines at the end of documentation
+        end = len(self.doc)
+        while end and not self.doc[end - 1]:
+            end -= 1
+
+        # To make sage linter happier
+        self.doc = [line.replace('\\choose ', 'choose ') if '\\choose ' in line else line
+                    for line in self.doc[:end]]
+
+    @staticmethod
+    def has_boolean_return_type(func_signature):
+        r"""
+        Determine whether the function func_signature has a boolean return type.
+
+        If so, it will be declared in Cython as `bint` rather than `int`.
+        """
+        if func_signature.count('(') != 1 or func_signature.count(')') != 1:
+            return False
+
+        j = func_signature.index('(')
+        func_name = func_signature[:j].strip().split()
+        if len(func_name) != 2:
+            return False
+
+        return_type = func_name[0]
+        if return_type != 'int':
+            return False
+
+        return _BOOLEAN_NAME_RE.search(func_name[1]) is not None
+
+    def clean_signatures(self):
+        if self.state & self.SIGNATURE_DECLARATION:
+            for i, func_signature in enumerate(self.signatures):
+                func_signature = _SIGNATURE_RE.sub(_signature_replacement, func_signature)
+
+                if self.has_boolean_return_type(func_signature):
+                    func_signature = func_signature.strip()
+                    if not func_signature.startswith('int '):
+                        raise RuntimeError
+                    func_signature = 'b' + func_signature
+
+                self.signatures[i] = func_signature
+
+    def add_declaration(self):
+        if self.state & self.FUNCTION_DECLARATION:
+            self.add_function()
+        elif self.state & self.MACRO_DECLARATION:
+            self.add_macro()
+        elif self.state & self.TYPE_DECLARATION:
+            self.add_type()
+
+        # NOTE: the lists are rebound rather than cleared as they might have
+        # been stored in self.functions by add_function
+        self.signatures = []
+        self.doc = []
+        self.state = self.NONE
+
+    def add_function(self):
+        self.clean_doc()
+
+        # Drop va_list argument
+        signatures = []
+        for func_signature in self.signatures:
+            if '(' not in func_signature or ')' not in func_signature:
+                raise RuntimeError(func_signature)
+            elif 'va_list ' in func_signature:
+                print('Warning: va_list unsupported {}'.format(func_signature))
+            else:
+                signatures.append(func_signature)
+        self.signatures = signatures
+        self.clean_signatures()
+
+        self.functions.append((self.signatures, self.doc))
+
+    def add_macro(self):
+        # TODO: we might want to support auto-generation of macros
+        return
+
+    def add_type(self):
+        # TODO: we might want to support auto-generation of types
+        return
+
+
+# cached contents are invalidated when the parser is modified
+_PARSER_MTIME = os.stat(__file__).st_mtime_ns
+
+# Extractor shared by all the calls to _parse in the process
+_EXTRACTOR = Extractor.__new__(Extractor)
+
+
+def _parse(filename):
+    r"""
+    Run the :class:`Extractor` on ``filename`` and return its content with the
+    function signatures and documentation converted to tuples.
+    """
+    e = _EXTRACTOR
+    e.reset(filename)
+    e.run()
+    return {section: [(tuple(func_signatures), tuple(doc)) for func_signatures, doc in functions]
+            for section, functions in e.content.items()}
+
+
+def _cache_path(filename, cache_dir):
+    r"""
+    Return the path of the pickle caching the content of ``filename``.
+    """
+    key = hashlib.blake2b(os.path.abspath(filename).encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, key + '.pkl')
+
+
+def _load_cached(filename, key, cache_dir):
+    r"""
+    Return the content of the .rst file ``filename`` using the pickle cache
+    stored in ``cache_dir``.
+
+    The cache entry is only used if it was stored with the same ``key``, made
+    of the modification time and size of ``filename`` and of the modification
+    time of this parser, so that the file is parsed again as soon as one of
+    them changes. Cache entries that can not be read or written are ignored.
+    """
+    cache_file = _cache_path(filename, cache_dir)
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_key, content = pickle.load(f)
+    except Exception:
+        # NOTE: missing, unreadable and corrupted entries are cache misses
+        pass
+    else:
+        if cached_key == key:
+            return content
+
+    content = _parse(filename)
+
+    # NOTE: the entry is written to a temporary file that is then renamed so
+    # that an interrupted or concurrent run never leaves a partial pickle. As
+    # the cache is only an optimization, failing to write it is not an error.
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, content), f, protocol=5)
+            os.replace(tmp_file, cache_file)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
+    except OSError:
+        pass
+
+    return content
+
+
+@lru_cache(maxsize=None)
+def _extract_functions(filename, key, cache_dir):
+    if cache_dir is not None:
+        return _load_cached(filename, key, cache_dir)
+
+    return _parse(filename)
+
+
+def extract_functions(filename, cache_dir=None):
+    r"""
+    OUTPUT:
+
+    dictionary: section -> list of pairs (func_sig, doc)
+
+    The result is memoized for the lifetime of the process as long as the
+    file is not modified. It is shared between calls and must not be
+    modified.
+
+    Arguments
+    filename -- (string) path to the .rst file
+    cache_dir -- (optional string) directory where the parsed content is cached
+    """
+    st = os.stat(filename)
+    return _extract_functions(filename, (st.st_mtime_ns, st.st_size, _PARSER_MTIME), cache_dir)